@@ -1,8 +1,15 @@
+import asyncio
 import csv
-import requests
+import aiohttp
+import httpx
 import time
-from datetime import datetime
+from itertools import islice
 import sys
+from urllib.parse import urlsplit, urlunsplit
+from wayback_common import (
+    BACKOFF_FACTOR, BUCKET, CDX_API_URL, LOOKUP_FAILED, MAX_RETRIES, USER_AGENT, json_loads, penalize_429,
+    timestamp_span, wayback_result,
+)
 
 try:
     from colorama import init, Fore, Style
@@ -16,106 +23,185 @@ except ImportError:
     blue = '\033[94m'
     reset = '\033[0m'
 
-def get_wayback_info(url):
-    cdx_url = "http://web.archive.org/cdx/search/cdx"
+CONCURRENCY = 20  # URLs checked at the same time
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+async def get_wayback_info(client, url):
+    """
+    Returns (first_seen_dt, last_seen_dt), both None if the URL has no snapshots,
+    or None if the CDX API could not be queried.
+    """
     params = {
         'url': url,
         'output': 'json',
         'fl': 'timestamp',
         'collapse': 'timestamp:8'
     }
-    
-    try:
-        response = requests.get(cdx_url, params=params, timeout=10)
-        response.raise_for_status()
-    except requests.RequestException:
-        return None, None
-
-    data = response.json()
-    if len(data) < 2:
-        return None, None
-
-    timestamps = [row[0] for row in data[1:]]
-    timestamps.sort()
-    first_seen = timestamps[0]
-    last_seen = timestamps[-1]
-
-    first_seen_dt = datetime.strptime(first_seen, "%Y%m%d%H%M%S")
-    last_seen_dt = datetime.strptime(last_seen, "%Y%m%d%H%M%S")
 
+    # All CDX queries go to the same host, so they share one multiplexed HTTP/2 connection
+    # (CDX_API_URL is https: HTTP/2 is only negotiated over TLS). They are paced like
+    # wayback_common.fetch_cdx(), on the same BUCKET, awaiting it instead of blocking.
+    for attempt in range(1, MAX_RETRIES + 1):
+        while wait := BUCKET.try_acquire():
+            await asyncio.sleep(wait)
+        try:
+            response = await client.get(CDX_API_URL, params=params)
+            if response.status_code == 429 and attempt < MAX_RETRIES:
+                # Retried once the bucket lets this request through again
+                penalize_429(BUCKET, response, url)
+                continue
+            response.raise_for_status()
+            data = json_loads(response.content)
+            break
+        except httpx.HTTPError:
+            if attempt == MAX_RETRIES:
+                return None
+            await asyncio.sleep(BACKOFF_FACTOR ** (attempt - 1))
+        except ValueError:
+            return None
+
+    first_seen_dt, last_seen_dt, _ = wayback_result(*timestamp_span(islice(data, 1, None)))
     return first_seen_dt, last_seen_dt
 
-def check_url_status(url):
+async def check_url_status(session, url):
+    # HEAD is enough to read the status code; only servers that reject it
+    # (405/501 or a broken HEAD handler) get a GET, whose body is never read.
     try:
-        r = requests.get(url, timeout=10)
-        return r.status_code
-    except requests.RequestException:
+        async with session.head(url, allow_redirects=True, timeout=REQUEST_TIMEOUT) as r:
+            if r.status not in (405, 501):
+                return r.status
+    except asyncio.TimeoutError:
         return None
+    except (aiohttp.ClientError, ValueError):
+        pass
 
-input_csv = "urls.csv"
-output_csv = "url_status_archive.csv"
-
-start_time = time.time()
-processing_times = []
-total_urls = 0
-
-# Count total URLs in advance for estimation
-with open(input_csv, newline='', encoding='utf-8') as infile:
-    reader = csv.reader(infile)
-    urls = [row[0].strip() for row in reader if row and row[0].strip()]
-    total_urls = len(urls)
-
-if total_urls == 0:
-    print("No URLs found in input file.")
-    exit()
-
-with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
-    writer = csv.writer(outfile)
-    writer.writerow(["URL", "Status_Code", "First_Seen", "Last_Seen"])
-
-    for i, url in enumerate(urls, start=1):
-        iteration_start = time.time()
-
-        # Check status
-        status_code = check_url_status(url)
-
-        # Get Wayback info
-        first_seen_dt, last_seen_dt = get_wayback_info(url)
+    try:
+        async with session.get(url, timeout=REQUEST_TIMEOUT) as r:
+            return r.status
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None
 
+def normalize_url(url):
+    """
+    Canonical form used to spot duplicate input URLs: lowercase scheme and host,
+    no fragment, no trailing slash. The path keeps its case, it may be case-sensitive.
+    A URL that cannot be parsed is its own key.
+    """
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+async def process_url(session, client, semaphore, queue, url_key, url):
+    """
+    Checks `url`, the first input URL seen for `url_key`, and queues its result under that key.
+    """
+    async with semaphore:
+        # Check status and get Wayback info at the same time (different hosts)
+        status_code, wayback_info = await asyncio.gather(
+            check_url_status(session, url),
+            get_wayback_info(client, url),
+        )
+
+    if wayback_info is None:
+        first_seen_str = last_seen_str = LOOKUP_FAILED
+    else:
+        first_seen_dt, last_seen_dt = wayback_info
         first_seen_str = first_seen_dt.strftime("%Y-%m-%d %H:%M:%S") if first_seen_dt else ""
         last_seen_str = last_seen_dt.strftime("%Y-%m-%d %H:%M:%S") if last_seen_dt else ""
-
-        writer.writerow([url, status_code, first_seen_str, last_seen_str])
-
-        # Clear the previous estimated time line
-        sys.stdout.write("\033[K")  # ANSI escape sequence to clear the line
-        sys.stdout.write(f"\r")  # Return carriage to the start of the line
-
-        # Print status info
-        print(f"Checked URL #{i}/{total_urls}: {url}")
-        print(f"  Status Code: {status_code}")
-        if first_seen_str or last_seen_str:
-            print(f"  First Seen: {first_seen_str}, Last Seen: {last_seen_str}")
-        else:
-            print("  No Wayback snapshots found.")
-        
-        # Time tracking
-        iteration_time = time.time() - iteration_start
-        if i <= 3:
-            processing_times.append(iteration_time)
-
-        # After the first 3 URLs, estimate completion time
-        if i >= 3 and len(processing_times) >= 3:
-            avg_time_per_url = sum(processing_times) / len(processing_times)
-            remaining = total_urls - i
-            estimated_total = (avg_time_per_url * total_urls)
-            estimated_remaining = estimated_total - (time.time() - start_time)
-            
-            # Print estimated time in blue, overwriting the same line
-            sys.stdout.write(f"\r{blue}Estimated time to completion: ~{estimated_remaining:.2f} seconds (~{estimated_remaining/60:.1f} minutes) remaining.{reset}")
-            sys.stdout.flush()
-
-# Final message
-end_time = time.time()
-elapsed = end_time - start_time
-print("\n" + green + f"Done. Time elapsed: {elapsed:.2f} seconds." + reset)
+    await queue.put((url_key, status_code, first_seen_str, last_seen_str))
+
+async def write_results(queue, writer, urls, start_time):
+    """
+    Single consumer for the CSV: results for unique normalized URLs arrive in
+    completion order, and one row per *input* URL is written in input order
+    as soon as its result is known.
+    """
+    total_urls = len(urls)
+    keys = [normalize_url(url) for url in urls]
+    results = {}
+    next_index = 0
+    while next_index < total_urls:
+        url_key, *result = await queue.get()
+        results[url_key] = result
+
+        while next_index < total_urls and keys[next_index] in results:
+            url = urls[next_index]
+            status_code, first_seen_str, last_seen_str = results[keys[next_index]]
+            writer.writerow([url, status_code, first_seen_str, last_seen_str])
+            next_index += 1
+
+            # Clear the previous estimated time line (ANSI clear line + carriage return)
+            sys.stdout.write("\033[K\r")
+
+            # Print status info
+            print(f"Checked URL #{next_index}/{total_urls}: {url}")
+            print(f"  Status Code: {status_code}")
+            if first_seen_str == LOOKUP_FAILED:
+                print("  Wayback lookup failed.")
+            elif first_seen_str or last_seen_str:
+                print(f"  First Seen: {first_seen_str}, Last Seen: {last_seen_str}")
+            else:
+                print("  No Wayback snapshots found.")
+
+            # After the first 3 URLs, estimate completion time from the observed throughput
+            if next_index >= 3:
+                elapsed = time.time() - start_time
+                estimated_remaining = elapsed / next_index * (total_urls - next_index)
+
+                # Print estimated time in blue, overwriting the same line
+                sys.stdout.write(f"\r{blue}Estimated time to completion: ~{estimated_remaining:.2f} seconds (~{estimated_remaining/60:.1f} minutes) remaining.{reset}")
+                sys.stdout.flush()
+
+async def main():
+    input_csv = "urls.csv"
+    output_csv = "url_status_archive.csv"
+
+    start_time = time.time()
+
+    # Count total URLs in advance for estimation
+    with open(input_csv, newline='', encoding='utf-8') as infile:
+        reader = csv.reader(infile)
+        urls = [row[0].strip() for row in reader if row and row[0].strip()]
+        total_urls = len(urls)
+
+    if total_urls == 0:
+        print("No URLs found in input file.")
+        return
+
+    # Duplicates (after normalization) are only checked once, through the first
+    # input URL seen for them: the normalized key itself may not be the same page
+    unique_urls = {}
+    for url in urls:
+        unique_urls.setdefault(normalize_url(url), url)
+
+    connector = aiohttp.TCPConnector(limit=100, limit_per_host=64, use_dns_cache=True, ttl_dns_cache=600)
+    cdx_limits = httpx.Limits(max_connections=50, max_keepalive_connections=50)
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    queue = asyncio.Queue()
+
+    with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["URL", "Status_Code", "First_Seen", "Last_Seen"])
+
+        async with aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT}) as session, \
+                httpx.AsyncClient(http2=True, limits=cdx_limits, timeout=10.0, headers={"User-Agent": USER_AGENT}) as client:
+            tasks = [process_url(session, client, semaphore, queue, url_key, url) for url_key, url in unique_urls.items()]
+            await asyncio.gather(write_results(queue, writer, urls, start_time), *tasks)
+
+    # Final message
+    end_time = time.time()
+    elapsed = end_time - start_time
+    print("\n" + green + f"Done. Time elapsed: {elapsed:.2f} seconds." + reset)
+
+if __name__ == "__main__":
+    # uvloop is a faster drop-in event loop; without it, use the stock one
+    # (selector-based on Windows, where uvloop is not available)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        if sys.platform == "win32":
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    asyncio.run(main())
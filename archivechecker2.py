@@ -1,11 +1,13 @@
-import csv
-import requests
+import pandas as pd
 import time
-from datetime import datetime
+from itertools import islice
 import sys
-import re
 import logging
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from wayback_common import (
+    SESSION, TokenBucket, WaybackCache, cache_dns_lookups, check_url_status, fetch_cdx, hosts_to_prefetch,
+    is_valid_url, json_loads, normalize_url, timestamp_span, urls_by_cdx_key, wayback_result,
+)
 
 try:
     from colorama import init, Fore, Style
@@ -23,99 +25,120 @@ logging.basicConfig(filename='script_final.log', level=logging.DEBUG,
                     format='%(asctime)s [%(levelname)s] %(message)s')
 
 # Constants
-CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
-MAX_RETRIES = 8
-BACKOFF_FACTOR = 4
-RATE_LIMIT_DELAY = 10  # Delay in seconds to maintain ~15 requests per minute
+CDX_RATE_LIMIT = 15   # CDX requests allowed per minute
+MAX_WORKERS = 32      # Rows checked at the same time
+PROGRESS_INTERVAL = 0.1  # Seconds between progress bar redraws
+HOST_PREFETCH_LIMIT = 100000  # Max snapshots fetched in one per-host CDX call
+CDX_CACHE_TTL = 7 * 24 * 3600      # Cached Wayback answers are reused for a week...
+CDX_NEGATIVE_CACHE_TTL = 24 * 3600 # ...but "no snapshots" answers are re-checked after a day
+
+CDX_BUCKET = TokenBucket(CDX_RATE_LIMIT, 60)  # A slower budget than wayback_common.BUCKET
+# requests has no DNS cache: reuse lookups across the many reconnections to the same hosts
+cache_dns_lookups()
+
+# On-disk cache of Wayback answers, so a rerun does not query the CDX API again
+CDX_CACHE = WaybackCache("wayback_cache.sqlite", CDX_CACHE_TTL, CDX_NEGATIVE_CACHE_TTL)
+
+def read_json(response):
+    """
+    Decoded JSON rows of a CDX response (header row first).
+    """
+    return json_loads(response.content)
 
 def get_wayback_info(url):
+    cached = CDX_CACHE.get(url)
+    if cached is not None:
+        logging.debug(f"Cache hit for URL {url}: {cached}")
+        first_ts, last_ts, _ = cached
+        return wayback_result(first_ts, last_ts)[:2]
+
     params = {
         'url': url,
         'output': 'json',
         'fl': 'timestamp',
         'collapse': 'timestamp:8'
     }
-
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            logging.debug(f"Attempt {attempt}: Requesting CDX API for URL: {url} with params: {params}")
-            response = requests.get(CDX_API_URL, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            logging.debug(f"CDX API JSON for {url}: {data}")
-
-            if len(data) < 2:
-                logging.info(f"No timestamps returned for URL {url}. Data length: {len(data)}")
-                return None, None
-
-            timestamps = [row[0] for row in data[1:]]
-            timestamps.sort()
-            if not timestamps:
-                logging.info(f"No timestamps in parsed data for URL {url}")
-                return None, None
-
-            first_seen = timestamps[0]
-            last_seen = timestamps[-1]
-
-            first_seen_dt = datetime.strptime(first_seen, "%Y%m%d%H%M%S")
-            last_seen_dt = datetime.strptime(last_seen, "%Y%m%d%H%M%S")
-
-            logging.debug(f"First seen: {first_seen_dt}, Last seen: {last_seen_dt} for URL {url}")
-            return first_seen_dt, last_seen_dt
-
-        except requests.RequestException as e:
-            logging.warning(f"RequestException on attempt {attempt} for URL {url}: {e}")
-            if attempt == MAX_RETRIES:
-                logging.error(f"Max retries exceeded for URL {url}")
-                return None, None
-            sleep_time = BACKOFF_FACTOR ** (attempt - 1)
-            logging.info(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
-        except ValueError as e:
-            logging.error(f"Error decoding JSON for URL {url}: {e}")
-            return None, None
-        except Exception as e:
-            logging.error(f"Unexpected error for URL {url}: {e}")
-            return None, None
-
-def check_url_status(url):
-    try:
-        logging.debug(f"Checking URL status for {url}")
-        response = requests.get(url, timeout=10)
-        logging.debug(f"Status code for {url}: {response.status_code}")
-        return response.status_code
-    except requests.RequestException as e:
-        logging.warning(f"Status check failed for {url}: {e}")
-        return None
-
-def is_valid_url(url):
-    if not url:
-        return False
-    pattern = re.compile(r'^(http(s)?://|www\.)[^\s]+$')
-    return bool(pattern.match(url))
-
-def normalize_url(url):
-    if url.startswith("www."):
-        return "http://" + url
-    parsed_url = urlparse(url)
-    if not parsed_url.scheme:
-        return "http://" + url
-    return url
+    data = fetch_cdx(params, read_json, bucket=CDX_BUCKET)
+    if data is None:
+        return None, None
+    logging.debug(f"CDX API JSON for {url}: {data}")
+
+    if len(data) < 2:
+        logging.info(f"No timestamps returned for URL {url}. Data length: {len(data)}")
+        CDX_CACHE.put(url, None, None)
+        return None, None
+
+    first_seen, last_seen = timestamp_span(islice(data, 1, None))
+    CDX_CACHE.put(url, first_seen, last_seen)
+
+    first_seen_dt, last_seen_dt, _ = wayback_result(first_seen, last_seen)
+
+    logging.debug(f"First seen: {first_seen_dt}, Last seen: {last_seen_dt} for URL {url}")
+    return first_seen_dt, last_seen_dt
+
+def prefetch_host(host, urls):
+    """
+    Fetches every snapshot of `host` (not its subdomains) with one CDX call and caches
+    the first/last timestamps of each of `urls`, so get_wayback_info() never has to
+    query them.
+    Snapshots are matched on the dump's 'urlkey', the same canonical form the CDX server
+    uses to answer a URL's own query. If the dump fails or hits HOST_PREFETCH_LIMIT,
+    nothing is cached; URLs without a match in the dump are not cached either. Both
+    fall back to their own queries.
+    """
+    params = {
+        'url': host,
+        'output': 'json',
+        'fl': 'urlkey,timestamp',
+        'matchType': 'host',
+        'limit': str(HOST_PREFETCH_LIMIT),
+    }
+    data = fetch_cdx(params, read_json, bucket=CDX_BUCKET)
+    if data is None or len(data) - 1 >= HOST_PREFETCH_LIMIT:
+        logging.info(f"Host prefetch unusable for {host}, querying its URLs one by one")
+        return
+
+    urls_by_key = urls_by_cdx_key(urls)
+
+    # get_wayback_info() sends collapse=timestamp:8, keeping only the first snapshot of
+    # each day. On a host query that would also collapse snapshots of *different* URLs
+    # taken on the same day, so the same answer is worked out here instead: last_ts is
+    # the first snapshot of the last day.
+    spans = {}
+    for urlkey, ts_str in islice(data, 1, None):
+        if urlkey not in urls_by_key:
+            continue
+        span = spans.get(urlkey)
+        if span is None:
+            spans[urlkey] = [ts_str, ts_str]
+            continue
+        if ts_str < span[0]:
+            span[0] = ts_str
+        if ts_str[:8] > span[1][:8] or (ts_str[:8] == span[1][:8] and ts_str < span[1]):
+            span[1] = ts_str
+
+    for urlkey, span in spans.items():
+        for url in urls_by_key[urlkey]:
+            CDX_CACHE.put(url, *span)
+    logging.debug(f"Prefetched {len(data) - 1} snapshots for host {host}, matching {len(spans)} of {len(urls_by_key)} URLs")
+
+# Live status checks get their own threads, so they never wait behind CDX calls
+STATUS_POOL = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 input_csv = "lista_finale.csv"
 output_csv = "lista_finale_post_script.csv"
 
-with open(input_csv, newline='', encoding='utf-8') as infile:
-    first_line = infile.readline().strip('\n')
-    fieldnames = [f.strip() for f in first_line.split(',')]
-    infile.seek(0)
-    reader = csv.DictReader(infile, fieldnames=fieldnames)
-    rows = list(reader)
+# One-shot vectorized read: every column as a plain string, empty cells as ""
+df = pd.read_csv(input_csv, dtype=str, keep_default_na=False)
+df.columns = df.columns.str.strip()
 
-if rows and rows[0][fieldnames[0]] == fieldnames[0]:
-    rows = rows[1:]
+def url_column(name):
+    return df[name].str.strip() if name in df.columns else pd.Series("", index=df.index)
 
-total_urls = len(rows)
+urls_progetto = url_column("URL progetto")
+urls_vetrina = url_column("URL sito vetrina")
+
+total_urls = len(df)
 
 if total_urls == 0:
     print("No URLs found in input file.")
@@ -123,25 +146,19 @@ if total_urls == 0:
     sys.exit()
 
 start_time = time.time()
-running_time_sum = 0.0
-
-extra_fields = [
-    "URL progetto First_Seen", "URL progetto Last_Seen", "URL progetto Status_Code",
-    "URL sito vetrina First_Seen", "URL sito vetrina Last_Seen", "URL sito vetrina Status_Code"
-]
 
-def process_url(url_value):
-    logging.debug(f"Processing URL: {url_value}")
+NOT_CHECKED = ("NOTFOUND", "NOTFOUND", "NOTFOUND")
 
-    if not is_valid_url(url_value):
-        logging.debug(f"URL is not valid or empty: {url_value}")
-        return "NOTFOUND", "NOTFOUND", "NOTFOUND"
+def process_url(normalized_url):
+    """
+    Live status and Wayback first/last seen for an already validated and normalized URL.
+    """
+    logging.debug(f"Processing URL: {normalized_url}")
 
-    normalized_url = normalize_url(url_value)
-    logging.debug(f"Normalized URL: {normalized_url}")
-
-    status_code = check_url_status(normalized_url)
+    # The live check runs alongside the (rate-limited) CDX lookup instead of before it
+    status_future = STATUS_POOL.submit(check_url_status, normalized_url)
     first_seen_dt, last_seen_dt = get_wayback_info(normalized_url)
+    status_code = status_future.result()
     first_seen_str = first_seen_dt.strftime("%Y-%m-%d %H:%M:%S") if first_seen_dt else ""
     last_seen_str = last_seen_dt.strftime("%Y-%m-%d %H:%M:%S") if last_seen_dt else ""
 
@@ -153,54 +170,59 @@ def process_url(url_value):
 
     return first_seen_str, last_seen_str, status_code
 
-with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
-    writer = csv.DictWriter(outfile, fieldnames=fieldnames + extra_fields)
-    writer.writeheader()
-
-    for i, row in enumerate(rows, start=1):
-        iteration_start = time.time()
+# "URL progetto" only; the "URL sito vetrina" columns are left empty for now
+# (pass urls_vetrina through process_url to fill them in).
+# The whole column is validated and normalized up front with wayback_common's
+# is_valid_url / normalize_url; each distinct URL is then checked once and its
+# result copied to every row that has it.
+progetto_valid = urls_progetto.map(is_valid_url)
+progetto_normalized = urls_progetto.where(~progetto_valid, urls_progetto[progetto_valid].map(normalize_url))
+logging.debug(f"{(~progetto_valid).sum()} rows without a valid 'URL progetto'")
+unique_urls = progetto_normalized[progetto_valid].unique().tolist()
+total_unique = len(unique_urls)
+unique_results = {}
+
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    # One CDX call per host with several URLs, instead of one per URL
+    prefetch_hosts = hosts_to_prefetch(unique_urls, CDX_CACHE)
+    list(executor.map(prefetch_host, prefetch_hosts.keys(), prefetch_hosts.values()))
+
+    # URLs are checked in parallel but map() yields results back in input order
+    last_ui = 0.0
+    for i, (url, result) in enumerate(zip(unique_urls, executor.map(process_url, unique_urls)), start=1):
+        unique_results[url] = result
+
+        # Redraw the progress bar at most every PROGRESS_INTERVAL seconds (and on the last URL)
+        if time.monotonic() - last_ui < PROGRESS_INTERVAL and i < total_unique:
+            continue
+        last_ui = time.monotonic()
 
-        url_progetto = row.get("URL progetto", "").strip()
-        url_sito_vetrina = row.get("URL sito vetrina", "").strip()
-
-        logging.debug(f"Row {i}: URL progetto: {url_progetto}, URL sito vetrina: {url_sito_vetrina}")
-
-        progetto_first_seen, progetto_last_seen, progetto_status = process_url(url_progetto)
-        # vetrina_first_seen, vetrina_last_seen, vetrina_status = process_url(url_sito_vetrina)
-        vetrina_first_seen = ""
-        vetrina_last_seen = ""
-        vetrina_status = ""
-
-        row["URL progetto First_Seen"] = progetto_first_seen
-        row["URL progetto Last_Seen"] = progetto_last_seen
-        row["URL progetto Status_Code"] = progetto_status
-
-        row["URL sito vetrina First_Seen"] = vetrina_first_seen
-        row["URL sito vetrina Last_Seen"] = vetrina_last_seen
-        row["URL sito vetrina Status_Code"] = vetrina_status
-
-        writer.writerow(row)
-
-        # Rate limiting to avoid exceeding the Wayback Machine's limits
-        time.sleep(RATE_LIMIT_DELAY)
-
-        iteration_time = time.time() - iteration_start
-        running_time_sum += iteration_time
         elapsed = time.time() - start_time
+        estimated_remaining = elapsed / i * (total_unique - i)
 
-        avg_time_per_url = running_time_sum / i
-        estimated_total = avg_time_per_url * total_urls
-        estimated_remaining = estimated_total - elapsed
-
-        progress_percentage = (i / total_urls) * 100
+        progress_percentage = (i / total_unique) * 100
         progress_bar_width = 50
-        filled_length = int(progress_bar_width * i / total_urls)
+        filled_length = int(progress_bar_width * i / total_unique)
         bar = '#' * filled_length + '-' * (progress_bar_width - filled_length)
 
-        sys.stdout.write("\033[K")
-        sys.stdout.write(f"\r{blue}[{bar}] {progress_percentage:.1f}% done | Estimated remaining: ~{estimated_remaining:.1f}s ({estimated_remaining/60:.1f}m){reset}")
+        sys.stdout.write(f"\033[K\r{blue}[{bar}] {progress_percentage:.1f}% done | Estimated remaining: ~{estimated_remaining:.1f}s ({estimated_remaining/60:.1f}m){reset}")
         sys.stdout.flush()
 
+# Assign the new columns as whole vectors and write the CSV in one go
+progetto_results = [
+    unique_results[url] if valid else NOT_CHECKED
+    for url, valid in zip(progetto_normalized, progetto_valid)
+]
+progetto_first_seen, progetto_last_seen, progetto_status = zip(*progetto_results)
+df["URL progetto First_Seen"] = progetto_first_seen
+df["URL progetto Last_Seen"] = progetto_last_seen
+df["URL progetto Status_Code"] = progetto_status
+df["URL sito vetrina First_Seen"] = ""
+df["URL sito vetrina Last_Seen"] = ""
+df["URL sito vetrina Status_Code"] = ""
+df.to_csv(output_csv, index=False)
+SESSION.close()
+
 end_time = time.time()
 total_elapsed = end_time - start_time
 print("\n" + green + f"Done. Time elapsed: {total_elapsed:.2f} seconds." + reset)
@@ -1,12 +1,17 @@
+import asyncio
 import csv
-import requests
 import time
-from datetime import datetime
 import sys
-import re
+import os
 import logging
+import threading
 from pathlib import Path
-from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from wayback_common import (
+    LOOKUP_FAILED, SESSION, WaybackCache, cache_dns_lookups, check_url_status, fetch_cdx, hosts_to_prefetch,
+    is_valid_url, normalize_url, urls_by_cdx_key, wayback_result,
+)
 
 try:
     from colorama import init, Fore, Style
@@ -30,159 +35,156 @@ logging.basicConfig(
 )
 
 # Constants
-CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
-MAX_RETRIES = 5
-BACKOFF_FACTOR = 2
-RATE_LIMIT_DELAY = 1          # Reduced: the slow API provides natural rate limiting
 REQUEST_TIMEOUT = 60          # Wayback CDX can be very slow, avoid unnecessary retries
+CONCURRENCY = 8               # Rows processed at the same time
+CDX_CONCURRENCY = 8           # CDX requests in flight at the same time
+HOST_PREFETCH_LIMIT = 100000  # Max snapshots fetched in one per-host CDX call
+PROGRESS_INTERVAL = 0.1       # Seconds between progress bar redraws
+PROGRESS_IDLE_INTERVAL = 1.0  # ...stretched to this while no row completes
+CHECKPOINT_EVERY = 50         # Rows written between flushes of the output CSV to disk
+CDX_CACHE_TTL = 24 * 3600     # Cached Wayback answers are reused for a day...
+CDX_NEGATIVE_CACHE_TTL = 3600 # ...but "no snapshots" answers are re-checked after an hour
+
+CDX_SLOTS = threading.BoundedSemaphore(CDX_CONCURRENCY)
+# Server-side snapshot filter: only 1xx-3xx captures are sent back, so 4xx/5xx ones
+# (and revisit records with no status code) never cross the wire
+CDX_STATUS_FILTER = 'statuscode:[123]..'
+# Threads for the "newest snapshot" query, so it runs alongside the "oldest" one
+NEWEST_POOL = ThreadPoolExecutor(max_workers=2 * CONCURRENCY)
+# requests has no DNS cache: reuse lookups across the many reconnections to the same hosts
+cache_dns_lookups()
+
+# On-disk cache of Wayback answers, keyed by normalized URL, shared by all worker threads
+CACHE_DIR = SCRIPT_DIR / "cache"
+CACHE_DIR.mkdir(exist_ok=True)
+CDX_CACHE = WaybackCache(CACHE_DIR / "cdx_cache.sqlite", CDX_CACHE_TTL, CDX_NEGATIVE_CACHE_TTL)
+
+def fetch_cdx_lines(params, consume):
+    """
+    fetch_cdx() with the plain-text ('output=cdx') response, within CDX_CONCURRENCY.
+    The response is streamed: `consume` receives an iterator of split lines and its
+    return value is passed through, so no response is ever held in memory.
+    Returns None if the request ultimately failed.
+    """
+    def consume_lines(response):
+        response.encoding = 'utf-8'
+        return consume(line.split(' ') for line in response.iter_lines(decode_unicode=True) if line)
+
+    return fetch_cdx(dict(params, output='cdx'), consume_lines, timeout=REQUEST_TIMEOUT, slots=CDX_SLOTS)
+
+def summarize_snapshots(lines, keys):
+    """
+    Single pass over (urlkey, timestamp, original) CDX lines, keeping only the urlkeys
+    in `keys`; 4xx/5xx snapshots never get here, the CDX server drops them (see
+    CDX_STATUS_FILTER).
+    Returns ({urlkey: [first_ts, last_ts, last_orig]}, number_of_lines_read).
+    "YYYYmmddHHMMSS" strings compare chronologically, so nothing is parsed or sorted.
+    """
+    summaries = {}
+    count = 0
+    for urlkey, ts_str, orig_url in lines:
+        count += 1
+        if urlkey not in keys:
+            continue
+        summary = summaries.get(urlkey)
+        if summary is None:
+            summaries[urlkey] = [ts_str, ts_str, orig_url]
+            continue
+        if ts_str < summary[0]:
+            summary[0] = ts_str
+        if ts_str > summary[1]:
+            summary[1] = ts_str
+            summary[2] = orig_url
+    return summaries, count
 
 def get_wayback_info(url):
     """
     Returns:
       (first_seen_dt, last_seen_dt, last_snapshot_link)
     for the URL from the Wayback Machine, considering ALL snapshots except 4xx and 5xx.
-    We remove 'collapse' so we can see all timestamps, then manually filter.
+    Instead of the whole history, two 1-row CDX queries fetch just the oldest and the
+    newest such snapshot; the CDX server does the filtering.
 
     last_snapshot_link is the clickable Wayback link for the most recent snapshot.
+    Returns None (rather than "no snapshots") if the CDX lookup failed.
+    Answers (including "no snapshots") are served from the on-disk cache while fresh,
+    which is also where prefetch_host() leaves them for hosts checked in bulk.
     """
+    cached = CDX_CACHE.get(url)
+    if cached is not None:
+        logging.debug(f"Cache hit for URL {url}: {cached}")
+        return wayback_result(*cached)
 
-    # No filter for status code here; we retrieve everything, then filter out 4xx, 5xx in Python.
     params = {
         'url': url,
-        'output': 'json',
-        'fl': 'timestamp,original,statuscode',
+        'fl': 'timestamp,original',
+        'filter': CDX_STATUS_FILTER,
         'matchType': 'exact',
     }
-
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            logging.debug(f"[Wayback Attempt {attempt}] Requesting CDX API for URL: {url} | Params={params}")
-            response = requests.get(CDX_API_URL, params=params, timeout=REQUEST_TIMEOUT)
-            response.raise_for_status()
-            data = response.json()
-
-            # data[0] = header row: ["timestamp","original","statuscode"]
-            # data[1:] = actual snapshot records
-            if len(data) < 2:
-                logging.info(f"No timestamps returned for URL {url}. Data length: {len(data)}")
-                return None, None, None
-
-            rows = data[1:]
-            if not rows:
-                logging.info(f"No valid rows in the response for URL {url}")
-                return None, None, None
-
-            # Filter out 4xx/5xx snapshots
-            valid_snapshots = []
-            for row in rows:
-                ts_str = row[0]   # "YYYYmmddHHMMSS"
-                orig_url = row[1]
-                code_str = row[2]
-                try:
-                    code_int = int(code_str)
-                except ValueError:
-                    # If for some reason code is non-numeric, skip
-                    continue
-
-                # Keep only if NOT in 400–599 range
-                if 400 <= code_int < 600:
-                    continue
-
-                valid_snapshots.append((ts_str, orig_url, code_int))
-
-            if not valid_snapshots:
-                logging.info(f"After filtering out 4xx/5xx, no snapshots left for URL {url}")
-                return None, None, None
-
-            # Sort by timestamp ascending
-            valid_snapshots.sort(key=lambda tup: tup[0])
-            first_ts, first_orig, first_code = valid_snapshots[0]
-            last_ts, last_orig, last_code = valid_snapshots[-1]
-
-            first_seen_dt = datetime.strptime(first_ts, "%Y%m%d%H%M%S")
-            last_seen_dt = datetime.strptime(last_ts, "%Y%m%d%H%M%S")
-
-            # Build the clickable Wayback link for the last snapshot
-            last_snapshot_link = f"https://web.archive.org/web/{last_ts}/{last_orig}"
-
-            logging.debug(f"First seen: {first_seen_dt}, Last seen: {last_seen_dt} (code={last_code}), Link={last_snapshot_link}")
-            return first_seen_dt, last_seen_dt, last_snapshot_link
-
-        except requests.RequestException as e:
-            logging.warning(f"RequestException on attempt {attempt} for URL {url}: {e}")
-            if attempt == MAX_RETRIES:
-                logging.error(f"Max retries exceeded for URL {url}")
-                return None, None, None
-            sleep_time = BACKOFF_FACTOR ** (attempt - 1)
-            logging.info(f"Retrying in {sleep_time} seconds...")
-            time.sleep(sleep_time)
-        except ValueError as e:
-            logging.error(f"Error decoding JSON for URL {url}: {e}")
-            return None, None, None
-        except Exception as e:
-            logging.error(f"Unexpected error for URL {url}: {e}")
-            return None, None, None
-
-def check_url_status(url):
-    """
-    Makes a standard GET request to check the *current* status code for the URL.
-    """
-    try:
-        logging.debug(f"Checking URL status for {url}")
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        return response.status_code
-    except requests.RequestException as e:
-        logging.warning(f"Status check failed for {url}: {e}")
+    first_line = lambda lines: next(lines, [])
+    # CDX returns snapshots oldest first; a negative limit counts from the newest one.
+    # Both queries are in flight at the same time.
+    last_future = NEWEST_POOL.submit(fetch_cdx_lines, dict(params, limit='-1', fastLatest='true'), first_line)
+    first = fetch_cdx_lines(dict(params, limit='1'), first_line)
+    last = last_future.result()
+    if first is None or last is None:
         return None
+    if not first:
+        logging.info(f"No snapshots outside 4xx/5xx returned for URL {url}")
+        CDX_CACHE.put(url, None, None, None)
+        return None, None, None
 
-def is_valid_url(url):
-    """
-    Checks if the given string matches an http/https or www-based URL format.
-    """
-    if not url:
-        return False
-    pattern = re.compile(r'^(http(s)?://|www\.)[^\s]+$')
-    return bool(pattern.match(url))
+    first_ts = first[0]
+    last_ts, last_orig = last or first
+    CDX_CACHE.put(url, first_ts, last_ts, last_orig)
+    first_seen_dt, last_seen_dt, last_snapshot_link = wayback_result(first_ts, last_ts, last_orig)
+
+    logging.debug(f"First seen: {first_seen_dt}, Last seen: {last_seen_dt}, Link={last_snapshot_link}")
+    return first_seen_dt, last_seen_dt, last_snapshot_link
 
-def normalize_url(url):
+def prefetch_host(host, urls):
     """
-    Ensures the URL has a scheme (http://) if missing, or if it starts with 'www.'
+    Fetches every snapshot of `host` (not its subdomains) with one CDX call and stores
+    the per-URL answer for each of `urls` in the cache, so get_wayback_info() never has
+    to query them.
+    Snapshots are matched on the dump's 'urlkey', the same canonical form the CDX server
+    uses to answer a URL's own query.
+    The dump is summarized as it streams in, so it is never held in memory as a whole.
+    If the dump fails or hits HOST_PREFETCH_LIMIT, nothing is cached; URLs without a
+    match in the dump are not cached either. Both fall back to their own queries.
     """
-    if url.startswith("www."):
-        return "http://" + url
-    parsed_url = urlparse(url)
-    if not parsed_url.scheme:
-        return "http://" + url
-    return url
-
-# Input/Output CSV files (OS-agnostic, relative to script location)
-input_csv = SCRIPT_DIR / "dataset" / "dataset_final.csv"
-output_csv = SCRIPT_DIR / "dataset" / "lista_finale_post_script_2026.csv"
-
-# Read the input CSV
-with open(input_csv, newline='', encoding='utf-8') as infile:
-    first_line = infile.readline().strip('\n')
-    fieldnames = [f.strip() for f in first_line.split(',')]
-    infile.seek(0)
-    reader = csv.DictReader(infile, fieldnames=fieldnames)
-    rows = list(reader)
+    params = {
+        'url': host,
+        'fl': 'urlkey,timestamp,original',
+        'filter': CDX_STATUS_FILTER,
+        'matchType': 'host',
+        'limit': str(HOST_PREFETCH_LIMIT),
+    }
+    urls_by_key = urls_by_cdx_key(urls)
+    keys = set(urls_by_key)
 
-# If the first row is the header row, remove it from actual data
-if rows and rows[0][fieldnames[0]] == fieldnames[0]:
-    rows = rows[1:]
+    result = fetch_cdx_lines(params, lambda lines: summarize_snapshots(lines, keys))
+    if result is None or result[1] >= HOST_PREFETCH_LIMIT:
+        logging.info(f"Host prefetch unusable for {host}, querying its URLs one by one")
+        return
 
-total_urls = len(rows)
+    summaries, count = result
+    for key, summary in summaries.items():
+        for url in urls_by_key[key]:
+            CDX_CACHE.put(url, *summary)
+    logging.debug(f"Prefetched {count} snapshots for host {host}, matching {len(summaries)} of {len(keys)} URLs")
 
-if total_urls == 0:
-    print("No URLs found in input file.")
-    logging.info("No URLs found in input file.")
-    sys.exit()
+# Live status checks get their own threads, so they never wait behind CDX calls
+STATUS_POOL = ThreadPoolExecutor(max_workers=2 * CONCURRENCY)
 
-start_time = time.time()
-running_time_sum = 0.0
+# Input/Output CSV files (OS-agnostic, relative to script location)
+input_csv = SCRIPT_DIR / "dataset" / "dataset_final.csv"
+output_csv = SCRIPT_DIR / "dataset" / "lista_finale_post_script_2026.csv"
 
 # We add a new column: "URL progetto Last_URL_Snapshot"
 # (Similarly for "URL sito vetrina Last_URL_Snapshot" if needed)
+URL_COLUMNS = ("URL progetto", "URL sito vetrina")
+
 extra_fields = [
     "URL progetto First_Seen", 
     "URL progetto Last_Seen", 
@@ -197,7 +199,7 @@ extra_fields = [
 def process_url(url_value):
     """
     Checks if the URL is valid, normalizes it, queries Wayback for first/last seen,
-    retrieves the last snapshot link, and does a live GET to retrieve current status code.
+    retrieves the last snapshot link, and does a live HEAD/GET to retrieve current status code.
     """
     logging.debug(f"Processing URL: {url_value}")
 
@@ -213,17 +215,25 @@ def process_url(url_value):
     normalized_url = normalize_url(url_value)
     logging.debug(f"Normalized URL: {normalized_url}")
 
-    # Current live status
-    status_code = check_url_status(normalized_url)
-    if status_code is None:
-        status_code = "NOSTATUSCODE"
+    # Current live status, checked alongside the (rate-limited) Wayback lookup
+    status_future = STATUS_POOL.submit(check_url_status, normalized_url, REQUEST_TIMEOUT)
 
     # Wayback data
-    first_dt, last_dt, last_url_snapshot = get_wayback_info(normalized_url)
+    wayback_info = get_wayback_info(normalized_url)
+
+    status_code = status_future.result()
+    if status_code is None:
+        status_code = "NOSTATUSCODE"
 
-    # Format the dates if they exist
-    first_str = first_dt.strftime("%Y-%m-%d %H:%M:%S") if first_dt else ""
-    last_str = last_dt.strftime("%Y-%m-%d %H:%M:%S") if last_dt else ""
+    if wayback_info is None:
+        # Marked, so that a rerun checks the URL again instead of keeping the row
+        first_str = last_str = LOOKUP_FAILED
+        last_url_snapshot = None
+    else:
+        # Format the dates if they exist
+        first_dt, last_dt, last_url_snapshot = wayback_info
+        first_str = first_dt.strftime("%Y-%m-%d %H:%M:%S") if first_dt else ""
+        last_str = last_dt.strftime("%Y-%m-%d %H:%M:%S") if last_dt else ""
 
     return {
         "first_seen": first_str,
@@ -232,62 +242,239 @@ def process_url(url_value):
         "last_snapshot_link": last_url_snapshot or ""
     }
 
-# Write to the output CSV
-with open(output_csv, 'w', newline='', encoding='utf-8') as outfile:
-    writer = csv.DictWriter(outfile, fieldnames=fieldnames + extra_fields)
-    writer.writeheader()
-
-    for i, row in enumerate(rows, start=1):
-        iteration_start = time.time()
-
-        url_progetto = row.get("URL progetto", "").strip()
-        url_sito_vetrina = row.get("URL sito vetrina", "").strip()
-
-        logging.debug(f"Row {i}: URL progetto: {url_progetto}, URL sito vetrina: {url_sito_vetrina}")
-
-        # Process "URL progetto"
-        progetto_info = process_url(url_progetto)
-        # Process "URL sito vetrina"
-        vetrina_info = process_url(url_sito_vetrina)
-
-        # Update the row with new fields
-        row["URL progetto First_Seen"] = progetto_info["first_seen"]
-        row["URL progetto Last_Seen"] = progetto_info["last_seen"]
-        row["URL progetto Status_Code"] = progetto_info["status_code"]
-        row["URL progetto Last_URL_Snapshot"] = progetto_info["last_snapshot_link"]
-
-        row["URL sito vetrina First_Seen"] = vetrina_info["first_seen"]
-        row["URL sito vetrina Last_Seen"] = vetrina_info["last_seen"]
-        row["URL sito vetrina Status_Code"] = vetrina_info["status_code"]
-        row["URL sito vetrina Last_URL_Snapshot"] = vetrina_info["last_snapshot_link"]
-
-        writer.writerow(row)
-
-        # Rate limiting ( ~15 requests per minute = 4s delay )
-        time.sleep(RATE_LIMIT_DELAY)
-
-        # Progress bar / time estimation
-        iteration_time = time.time() - iteration_start
-        running_time_sum += iteration_time
-        elapsed = time.time() - start_time
+def read_fieldnames():
+    """
+    Field names from the input CSV's header row, stripped of surrounding spaces.
+    """
+    with open(input_csv, newline='', encoding='utf-8') as infile:
+        return [f.strip() for f in next(csv.reader(infile), [])]
 
-        avg_time_per_url = running_time_sum / i
-        estimated_total = avg_time_per_url * total_urls
-        estimated_remaining = estimated_total - elapsed
+def iter_rows(fieldnames, skip=None):
+    """
+    Lazily yields the input CSV rows as lists, without the header row, padded or cut
+    to one value per field. `skip` counts, by their values, rows that must be left out
+    that many times (see load_checkpoint).
+    """
+    skip = Counter(skip)
+    width = len(fieldnames)
+    with open(input_csv, newline='', encoding='utf-8') as infile:
+        reader = csv.reader(infile)
+        next(reader, None)
+        for row in reader:
+            if not row:
+                continue
+            row = row[:width] + [""] * (width - len(row))
+            key = tuple(row)
+            if skip[key]:
+                skip[key] -= 1
+                continue
+            yield row
+
+def row_urls(row, url_indices):
+    """
+    The row's URL_COLUMNS values, stripped; "" for a column missing from the input.
+    """
+    return [row[index].strip() if index is not None else "" for index in url_indices]
 
-        progress_percentage = (i / total_urls) * 100
-        progress_bar_width = 50
-        filled_length = int(progress_bar_width * i / total_urls)
-        bar = '#' * filled_length + '-' * (progress_bar_width - filled_length)
+def load_checkpoint(fieldnames):
+    """
+    Rows already written to output_csv by an interrupted run, so a rerun can skip them.
+    A row cut short by the interruption, or with a failed Wayback lookup (LOOKUP_FAILED),
+    is dropped and checked again; an output with a different header is ignored.
+    """
+    path = Path(output_csv)
+    if not path.exists() or path.stat().st_size == 0:
+        return []
+    # Every complete row ends with a line terminator: if the file does not, its last
+    # record was cut short, possibly inside its last field (which no length check sees)
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        complete = f.read(1) == b'\n'
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header != fieldnames + extra_fields:
+            return []
+        rows = list(reader)
+    if not complete and rows:
+        rows.pop()
+    return [
+        row for row in rows
+        if len(row) == len(header) and LOOKUP_FAILED not in row[len(fieldnames):]
+    ]
+
+def check_once(checks, url_value):
+    """
+    Returns the shared task running process_url() for url_value: rows repeating a URL
+    (after normalization) await the same check instead of starting a new one.
+    """
+    key = normalize_url(url_value) if is_valid_url(url_value) else url_value
+    if key not in checks:
+        checks[key] = asyncio.ensure_future(asyncio.to_thread(process_url, url_value))
+    return checks[key]
 
-        sys.stdout.write("\033[K")  # Clear line
-        sys.stdout.write(
-            f"\r{blue}[{bar}] {progress_percentage:.1f}% done | "
-            f"Estimated remaining: ~{estimated_remaining:.1f}s ({estimated_remaining/60:.1f}m){reset}"
+async def process_row(queue, checks, i, row, url_indices):
+    """
+    Processes both URLs of a row concurrently in worker threads (the blocking requests
+    calls share SESSION), then hands the output values (input values + extra_fields)
+    to the CSV writer. URLs already seen in another row are not checked again.
+    """
+    url_progetto, url_sito_vetrina = row_urls(row, url_indices)
+
+    logging.debug(f"Row {i}: URL progetto: {url_progetto}, URL sito vetrina: {url_sito_vetrina}")
+
+    # Process "URL progetto" and "URL sito vetrina" at the same time
+    progetto_info, vetrina_info = await asyncio.gather(
+        check_once(checks, url_progetto),
+        check_once(checks, url_sito_vetrina),
+    )
+
+    values = row + [
+        progetto_info["first_seen"],
+        progetto_info["last_seen"],
+        progetto_info["status_code"],
+        progetto_info["last_snapshot_link"],
+        vetrina_info["first_seen"],
+        vetrina_info["last_seen"],
+        vetrina_info["status_code"],
+        vetrina_info["last_snapshot_link"],
+    ]
+    await queue.put((i, values))
+
+async def write_rows(queue, outfile, writer, total_urls, progress):
+    """
+    Single consumer for the output CSV: rows arrive in completion order and are
+    written in input order, holding early ones until their turn comes. Every
+    CHECKPOINT_EVERY rows the file is synced to disk, so a crash loses little work.
+    """
+    pending = {}
+    while progress["done"] < total_urls:
+        i, row = await queue.get()
+        pending[i] = row
+
+        while progress["done"] + 1 in pending:
+            writer.writerow(pending.pop(progress["done"] + 1))
+            progress["done"] += 1
+            if progress["done"] % CHECKPOINT_EVERY == 0:
+                outfile.flush()
+                os.fsync(outfile.fileno())
+
+async def progress_loop(total_urls, start_time, progress):
+    """
+    Redraws the progress bar from the shared counter every PROGRESS_INTERVAL seconds,
+    so terminal output does not depend on how fast rows complete. While the counter
+    does not move, only the time estimate changes, so it is redrawn less often.
+    """
+    last_done = 0
+    last_draw = 0.0
+    while True:
+        done = progress["done"]
+        now = time.monotonic()
+        if done and (done != last_done or now - last_draw >= PROGRESS_IDLE_INTERVAL):
+            last_done = done
+            last_draw = now
+
+            # Progress bar / time estimation
+            elapsed = time.time() - start_time
+            estimated_remaining = elapsed / done * (total_urls - done)
+
+            progress_percentage = (done / total_urls) * 100
+            progress_bar_width = 50
+            filled_length = int(progress_bar_width * done / total_urls)
+            bar = '#' * filled_length + '-' * (progress_bar_width - filled_length)
+
+            sys.stdout.write(
+                f"\033[K\r{blue}[{bar}] {progress_percentage:.1f}% done | "
+                f"Estimated remaining: ~{estimated_remaining:.1f}s ({estimated_remaining/60:.1f}m){reset}"
+            )
+            sys.stdout.flush()
+
+        if done >= total_urls:
+            return
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+async def main():
+    # The input CSV is never held in memory: it is read lazily, once per pass
+    fieldnames = read_fieldnames()
+    url_indices = [fieldnames.index(c) if c in fieldnames else None for c in URL_COLUMNS]
+
+    if next(iter_rows(fieldnames), None) is None:
+        print("No URLs found in input file.")
+        logging.info("No URLs found in input file.")
+        return
+
+    # Resume: rows already in the output from an interrupted run are kept as they are
+    done_rows = load_checkpoint(fieldnames)
+    done = Counter(tuple(row[:len(fieldnames)]) for row in done_rows)
+
+    total_urls = sum(1 for _ in iter_rows(fieldnames, done))
+
+    if done_rows:
+        print(f"Resuming: {len(done_rows)} rows already checked, {total_urls} left.")
+        logging.info(f"Resuming from {output_csv}: {len(done_rows)} rows already checked, {total_urls} left.")
+    if total_urls == 0:
+        return
+
+    start_time = time.time()
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    queue = asyncio.Queue()
+    progress = {"done": 0}
+    checks = {}
+
+    # One CDX call per host with several URLs, instead of one per URL
+    async def prefetch(host, urls):
+        async with semaphore:
+            await asyncio.to_thread(prefetch_host, host, urls)
+
+    prefetch_hosts = hosts_to_prefetch(
+        (normalize_url(url_value) for row in iter_rows(fieldnames, done)
+         for url_value in row_urls(row, url_indices) if is_valid_url(url_value)),
+        CDX_CACHE
+    )
+    await asyncio.gather(*(prefetch(host, urls) for host, urls in prefetch_hosts.items()))
+
+    # The checkpoint (header + complete rows only) is rewritten to a temporary file that then
+    # replaces it, so rows from earlier runs are on disk at every moment; new rows are appended
+    tmp_csv = Path(f"{output_csv}.tmp")
+    with open(tmp_csv, 'w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(fieldnames + extra_fields)
+        writer.writerows(done_rows)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_csv, output_csv)
+
+    with open(output_csv, 'a', newline='', encoding='utf-8', buffering=1 << 20) as outfile:
+        writer = csv.writer(outfile)
+
+        # CONCURRENCY workers pull rows from the same lazy reader as they go
+        rows = enumerate(iter_rows(fieldnames, done), start=1)
+
+        async def worker():
+            for i, row in rows:
+                await process_row(queue, checks, i, row, url_indices)
+
+        await asyncio.gather(
+            write_rows(queue, outfile, writer, total_urls, progress),
+            progress_loop(total_urls, start_time, progress),
+            *(worker() for _ in range(CONCURRENCY))
         )
-        sys.stdout.flush()
 
-end_time = time.time()
-total_elapsed = end_time - start_time
-print("\n" + green + f"Done. Time elapsed: {total_elapsed:.2f} seconds." + reset)
-logging.info(f"Processing complete. Time elapsed: {total_elapsed:.2f} seconds.")
+    end_time = time.time()
+    total_elapsed = end_time - start_time
+    print("\n" + green + f"Done. Time elapsed: {total_elapsed:.2f} seconds." + reset)
+    logging.info(f"Processing complete. Time elapsed: {total_elapsed:.2f} seconds.")
+
+if __name__ == "__main__":
+    # uvloop is a faster drop-in event loop; without it, use the stock one
+    # (selector-based on Windows, where uvloop is not available)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        if sys.platform == "win32":
+            asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    try:
+        asyncio.run(main())
+    finally:
+        SESSION.close()
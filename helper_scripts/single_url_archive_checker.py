@@ -1,39 +1,11 @@
 #!/usr/bin/env python3
 
-import requests
-import time
-import re
-from urllib.parse import urlparse
-from datetime import datetime
-
-CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
-MAX_RETRIES = 8
-BACKOFF_FACTOR = 4
-
-def is_valid_url(url: str) -> bool:
-    """Checks if the given string is a syntactically valid URL (http(s) or www)."""
-    pattern = re.compile(r'^(http(s)?://|www\.)[^\s]+$')
-    return bool(pattern.match(url))
-
-def normalize_url(url: str) -> str:
-    """Ensure the URL has a scheme (http://) if missing, or if it starts with 'www.'."""
-    if url.startswith("www."):
-        return "http://" + url
-    parsed = urlparse(url)
-    if not parsed.scheme:
-        return "http://" + url
-    return url
-
-def check_live_status(url: str) -> int or None:
-    """
-    Makes a live GET request to the provided URL.
-    Returns the status code or None if the request fails.
-    """
-    try:
-        resp = requests.get(url, timeout=10)
-        return resp.status_code
-    except requests.RequestException:
-        return None
+import sys
+from pathlib import Path
+
+# wayback_common.py lives in the repository root, next to the archive checkers
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wayback_common import SESSION, cdx_query, check_url_status, is_valid_url, normalize_url, parse_ts
 
 def get_wayback_snapshots(url: str):
     """
@@ -43,51 +15,26 @@ def get_wayback_snapshots(url: str):
     """
     params = {
         'url': url,
-        'output': 'json',
         'fl': 'timestamp,original,statuscode',
         'filter': 'statuscode:200',
         'limit': '5000',
         # 'matchType': 'prefix',  # Uncomment if needed for domain variants
     }
 
-    for attempt in range(1, MAX_RETRIES + 1):
-        try:
-            resp = requests.get(CDX_API_URL, params=params, timeout=10)
-            resp.raise_for_status()
-            data = resp.json()
-
-            # data[0] should be headers ["timestamp","original","statuscode"]
-            # data[1:] are the actual rows
-            if len(data) < 2:
-                return [], None, None  # no snapshots
-
-            rows = data[1:]
-            if not rows:
-                return [], None, None
-
-            # row = [timestamp, original, statuscode]
-            # Convert each row's timestamp to a proper string
-            # We only have 200-coded snapshots here due to 'filter=statuscode:200'
-            snapshots = [(row[0], row[1], row[2]) for row in rows]
-            # Sort by timestamp ascending
-            snapshots.sort(key=lambda r: r[0])
-
-            first_ts = snapshots[0][0]
-            last_ts = snapshots[-1][0]
-
-            first_dt = datetime.strptime(first_ts, "%Y%m%d%H%M%S")
-            last_dt = datetime.strptime(last_ts, "%Y%m%d%H%M%S")
-
-            return snapshots, first_dt, last_dt
-
-        except requests.RequestException:
-            # Exponential backoff
-            if attempt == MAX_RETRIES:
-                return [], None, None
-            time.sleep(BACKOFF_FACTOR ** (attempt - 1))
-        except ValueError:
-            # JSON decode error or invalid data
-            return [], None, None
+    rows = cdx_query(params)
+    if not rows:
+        return [], None, None  # no snapshots
+
+    # row = [timestamp, original, statuscode]
+    # We only have 200-coded snapshots here due to 'filter=statuscode:200'
+    snapshots = [(row[0], row[1], row[2]) for row in rows]
+    # Sort by timestamp ascending
+    snapshots.sort(key=lambda r: r[0])
+
+    first_dt = parse_ts(snapshots[0][0])
+    last_dt = parse_ts(snapshots[-1][0])
+
+    return snapshots, first_dt, last_dt
 
 def main():
     # Ask for the URL from the user
@@ -102,7 +49,7 @@ def main():
     normalized_url = normalize_url(input_url)
 
     # 1) Check the live status code
-    status_code = check_live_status(normalized_url)
+    status_code = check_url_status(normalized_url)
     if status_code is None:
         print(f"Could not retrieve the live status code for: {normalized_url}")
     else:
@@ -120,7 +67,7 @@ def main():
     print("\nList of Wayback Machine Snapshots (HTTP 200 only):")
     for ts, original, code in snapshots:
         # Convert timestamp (YYYYmmddHHMMSS) to a friendlier format
-        dt_str = datetime.strptime(ts, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+        dt_str = parse_ts(ts).strftime("%Y-%m-%d %H:%M:%S")
         print(f"- {dt_str} | {original} | statuscode={code}")
 
     # 4) Print total, first seen, last seen
@@ -132,4 +79,7 @@ def main():
     print(f"Last seen:  {last_str}")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        SESSION.close()
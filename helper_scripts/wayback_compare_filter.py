@@ -1,62 +1,55 @@
 #!/usr/bin/env python3
 
 import sys
-import requests
-from datetime import datetime
-from urllib.parse import urlparse
+from pathlib import Path
 from colorama import init, Fore, Style
 
+# wayback_common.py lives in the repository root, next to the archive checkers
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from wayback_common import SESSION, cdx_query, normalize_url, parse_ts
+
 init(autoreset=True)
 green = Fore.GREEN
 blue = Fore.BLUE
 reset = Style.RESET_ALL
 
-CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
-
-def normalize_url(url: str) -> str:
-    """Ensure the URL has http:// scheme if missing, or if it only has 'www.'."""
-    if url.startswith("www."):
-        return "http://" + url
-    parsed = urlparse(url)
-    if not parsed.scheme:
-        return "http://" + url
-    return url
+RECENT_SNAPSHOTS = 50  # Newest snapshots scanned for a code 200 before querying for one explicitly
 
-def get_last_snapshot(url: str, filter_200: bool = False):
+def get_recent_snapshots(url: str, limit: int, filter_200: bool = False):
     """
-    Fetch the *most recent* snapshot from the CDX API.
+    Fetch the `limit` *most recent* snapshots from the CDX API, newest first.
     If filter_200=True, only return snapshots with statuscode=200.
-    Returns a tuple: (timestamp_str, original_url, status_code) or None if none found.
+    Returns a list of (timestamp_str, original_url, status_code) tuples (empty if none found).
     """
-    # We ask the CDX API for just 1 record, sorted in descending order (most recent).
     params = {
         "url": url,
-        "output": "json",
         "fl": "timestamp,original,statuscode",
-        "limit": "1",
+        "limit": str(limit),
         "sort": "reverse"
     }
     if filter_200:
         params["filter"] = "statuscode:200"
-    
-    try:
-        resp = requests.get(CDX_API_URL, params=params, timeout=10)
-        resp.raise_for_status()
-        data = resp.json()
-    except requests.RequestException:
-        return None
-
-    # data[0] = header row -> ["timestamp","original","statuscode"]
-    # data[1:] = actual rows
-    if len(data) < 2:
-        return None
-    
-    row = data[1][0:3]  # [timestamp, original, statuscode]
-    # Example row: ["20230102123456", "http://example.com/", "302"]
-    timestamp_str = row[0]
-    original_url = row[1]
-    code = row[2]
-    return timestamp_str, original_url, code
+
+    # Each row is [timestamp, original, statuscode], e.g. ["20230102123456", "http://example.com/", "302"]
+    return [tuple(row[0:3]) for row in cdx_query(params)]
+
+def get_last_snapshots(url: str):
+    """
+    Fetch the most recent snapshot (any code) and the most recent one with code 200.
+    One query covers both as long as a 200 is among the newest RECENT_SNAPSHOTS rows;
+    only otherwise is a second, filtered query made.
+    Returns a tuple (snapshot_any, snapshot_200), each one as returned by
+    get_recent_snapshots() or None if none found.
+    """
+    snapshots = get_recent_snapshots(url, RECENT_SNAPSHOTS)
+    if not snapshots:
+        return None, None
+
+    snapshot_any = snapshots[0]
+    snapshot_200 = next((row for row in snapshots if row[2] == "200"), None)
+    if snapshot_200 is None:
+        snapshot_200 = next(iter(get_recent_snapshots(url, 1, filter_200=True)), None)
+    return snapshot_any, snapshot_200
 
 def format_wayback_url(timestamp_str, original_url):
     """Return a full clickable Wayback Machine URL."""
@@ -75,17 +68,15 @@ def main():
 
     normalized_url = normalize_url(input_url)
 
-    # 1) Last snapshot *regardless* of code
-    snapshot_any = get_last_snapshot(normalized_url, filter_200=False)
-    # 2) Last snapshot *with* code=200
-    snapshot_200 = get_last_snapshot(normalized_url, filter_200=True)
+    # 1) Last snapshot *regardless* of code, 2) last snapshot *with* code=200
+    snapshot_any, snapshot_200 = get_last_snapshots(normalized_url)
 
     print(f"\nChecking most recent snapshots for: {normalized_url}\n")
 
     # Print 1) last snapshot ANY code
     if snapshot_any:
         ts_any, orig_any, code_any = snapshot_any
-        dt_any = datetime.strptime(ts_any, "%Y%m%d%H%M%S")
+        dt_any = parse_ts(ts_any)
         wb_url_any = format_wayback_url(ts_any, orig_any)
         print(f"Most recent snapshot (ANY code):")
         print(
@@ -101,7 +92,7 @@ def main():
     # Print 2) last snapshot code=200
     if snapshot_200:
         ts_200, orig_200, code_200 = snapshot_200
-        dt_200 = datetime.strptime(ts_200, "%Y%m%d%H%M%S")
+        dt_200 = parse_ts(ts_200)
         wb_url_200 = format_wayback_url(ts_200, orig_200)
         print(f"Most recent snapshot (code=200 only):")
         print(
@@ -113,4 +104,7 @@ def main():
         print(f"Most recent snapshot (code=200 only): None found.")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        SESSION.close()
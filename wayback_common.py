@@ -0,0 +1,371 @@
+"""
+Pieces shared by the archive checkers and the helper scripts: URL checks, one pooled
+requests Session, the CDX token bucket and answer cache, live status checks, the CDX
+request loop (rate limit, 429 pauses, retries), the helpers that turn CDX rows into
+first/last seen dates and the helpers that batch CDX lookups per host.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+import time
+from datetime import datetime
+import logging
+import sqlite3
+import threading
+import socket
+import functools
+from contextlib import nullcontext
+from collections import defaultdict
+from urllib.parse import urlparse, urlsplit
+
+try:
+    # orjson parses the CDX JSON arrays straight into lists, much faster than the stdlib
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.NullHandler())
+
+CDX_API_URL = "https://web.archive.org/cdx/search/cdx"
+CDX_RATE_LIMIT = 60   # CDX requests allowed per minute (see BUCKET)
+CDX_TIMEOUT = 10      # Seconds, default timeout of a CDX request
+CDX_429_PENALTY = 60  # Minimum seconds all CDX requests pause after a 429
+MAX_RETRIES = 5       # fetch_cdx() attempts
+BACKOFF_FACTOR = 2
+URL_PREFIXES = ("http://", "https://", "www.")
+USER_AGENT = "archivechecker/1.0 (+https://github.com/gspinaci/Vita-e-morte-DH-projects)"
+DNS_CACHE_TTL = 600   # Seconds a cached DNS lookup is reused (see cache_dns_lookups)
+LOOKUP_FAILED = "LOOKUPFAILED"  # First/Last Seen of a URL whose CDX query failed
+
+def cache_dns_lookups(ttl=DNS_CACHE_TTL):
+    """
+    Makes socket.getaddrinfo reuse each answer for `ttl` seconds, so threads reconnecting
+    to the same host do not resolve it again. The patch is process-wide: it is meant for
+    the requests-based checkers (requests has no DNS cache of its own) and must be called
+    explicitly by them. Calling it again does nothing.
+    """
+    lookup = socket.getaddrinfo
+    if getattr(lookup, "dns_cache_ttl", None) is not None:
+        return
+    answers = {}
+    lock = threading.Lock()
+
+    @functools.wraps(lookup)
+    def getaddrinfo(*args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with lock:
+            answer = answers.get(key)
+        if answer is not None and answer[0] > now:
+            return answer[1]
+        result = lookup(*args, **kwargs)
+        with lock:
+            answers[key] = (now + ttl, result)
+        return result
+
+    getaddrinfo.dns_cache_ttl = ttl
+    socket.getaddrinfo = getaddrinfo
+
+class TCPTunedAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose sockets disable Nagle's algorithm and send TCP keep-alive probes.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = [
+            (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+# One shared session so keep-alive reuses connections (especially to web.archive.org).
+# It never retries by itself: fetch_cdx() retries CDX calls through a token bucket.
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = USER_AGENT
+SESSION.headers["Connection"] = "keep-alive"
+_adapter = TCPTunedAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: acquire() blocks only when the request budget
+    (rate requests per period seconds) is actually used up, or while the bucket
+    is frozen by penalize().
+    """
+    def __init__(self, rate, period):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        """
+        Takes a token and returns 0 if one is available, otherwise returns the seconds
+        to wait before trying again. Never blocks, so coroutines can await the wait.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now < self.updated:
+                # Frozen: nothing refills until the penalty is over
+                return self.updated - now
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.fill_rate
+
+    def acquire(self):
+        while wait := self.try_acquire():
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """
+        Empties the bucket and freezes it for `seconds`, so that every thread
+        backs off together (e.g. after a 429).
+        """
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+def retry_after_seconds(response, default):
+    """
+    Seconds to wait as requested by a 429 response's Retry-After header, or default.
+    """
+    try:
+        return max(int(response.headers.get("Retry-After", default)), 1)
+    except ValueError:
+        return default
+
+def penalize_429(bucket, response, url):
+    """
+    Repeated 429s get the IP blocked: pauses *all* requests drawing on `bucket` for the
+    response's Retry-After, but at least CDX_429_PENALTY seconds.
+    """
+    penalty = max(retry_after_seconds(response, CDX_429_PENALTY), CDX_429_PENALTY)
+    logger.warning(f"CDX API rate limit hit (429) for URL {url}, pausing CDX requests for {penalty} seconds")
+    bucket.penalize(penalty)
+
+# CDX request budget shared by every CDX call made in this process
+BUCKET = TokenBucket(CDX_RATE_LIMIT, 60)
+
+class WaybackCache:
+    """
+    On-disk cache of Wayback answers keyed by normalized URL, safe to share between
+    threads. Answers are reused for `ttl` seconds, "no snapshots" ones for `negative_ttl`.
+    """
+    def __init__(self, path, ttl, negative_ttl):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS wayback_info "
+            "(url TEXT PRIMARY KEY, first_ts TEXT, last_ts TEXT, last_orig TEXT, fetched_at REAL)"
+        )
+        # Caches written before the last snapshot's URL was stored lack its column
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(wayback_info)")}
+        if "last_orig" not in columns:
+            self.db.execute("ALTER TABLE wayback_info ADD COLUMN last_orig TEXT")
+
+    def get(self, url):
+        """
+        Returns the cached (first_ts, last_ts, last_orig) for the URL, or None on a miss
+        or if the entry is older than its TTL. Negative answers come back as (None, None, None).
+        """
+        with self.lock:
+            entry = self.db.execute(
+                "SELECT first_ts, last_ts, last_orig, fetched_at FROM wayback_info WHERE url = ?", (url,)
+            ).fetchone()
+        if entry is None:
+            return None
+        first_ts, last_ts, last_orig, fetched_at = entry
+        ttl = self.ttl if first_ts else self.negative_ttl
+        if time.time() - fetched_at > ttl:
+            return None
+        return first_ts, last_ts, last_orig
+
+    def put(self, url, first_ts, last_ts, last_orig=None):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO wayback_info (url, first_ts, last_ts, last_orig, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, first_ts, last_ts, last_orig, time.time())
+            )
+            self.db.commit()
+
+def parse_ts(ts_str):
+    """
+    Parses a CDX "YYYYmmddHHMMSS" timestamp; plain slicing is much cheaper than strptime.
+    """
+    return datetime(int(ts_str[0:4]), int(ts_str[4:6]), int(ts_str[6:8]),
+                    int(ts_str[8:10]), int(ts_str[10:12]), int(ts_str[12:14]))
+
+def is_valid_url(url):
+    """
+    Checks if the given string matches an http/https or www-based URL format.
+    """
+    if not url:
+        return False
+    # Same rule as the regex ^(https?://|www\.)\S+$, but with plain string checks:
+    # a known prefix, something after it, and no whitespace anywhere (splitting on
+    # whitespace gives back the URL itself)
+    return url.startswith(URL_PREFIXES) and url not in URL_PREFIXES and url.split() == [url]
+
+def normalize_url(url):
+    """
+    Ensures the URL has a scheme (http://) if missing, or if it starts with 'www.'
+    """
+    if url.startswith(("http://", "https://")):
+        return url
+    if url.startswith("www."):
+        return "http://" + url
+    # Anything else (another scheme, or none at all) still goes through the parser
+    if not urlparse(url).scheme:
+        return "http://" + url
+    return url
+
+def check_url_status(url, timeout=10):
+    """
+    Checks the *current* status code for the URL with a HEAD request (following redirects).
+    Servers that reject HEAD (405/501 or a failing HEAD handler) get a streamed GET instead,
+    closed before any of the body is read. Returns None if the request fails.
+    """
+    try:
+        logger.debug(f"Checking URL status for {url}")
+        response = SESSION.head(url, allow_redirects=True, timeout=timeout)
+        if response.status_code not in (405, 501):
+            return response.status_code
+    except requests.Timeout as e:
+        logger.warning(f"Status check failed for {url}: {e}")
+        return None
+    except requests.RequestException as e:
+        logger.debug(f"HEAD failed for {url}: {e}, retrying with GET")
+
+    try:
+        with SESSION.get(url, stream=True, timeout=timeout) as response:
+            return response.status_code
+    except requests.RequestException as e:
+        logger.warning(f"Status check failed for {url}: {e}")
+        return None
+
+def fetch_cdx(params, consume, bucket=BUCKET, timeout=CDX_TIMEOUT, slots=nullcontext()):
+    """
+    Queries the CDX API, taking a token from `bucket` for every attempt and retrying
+    with exponential backoff; a 429 pauses the whole bucket (see penalize_429).
+    The response is streamed: `consume` receives it and its return value is passed
+    through. `slots` (e.g. a semaphore) is held while the request is in flight.
+    Returns None if the request ultimately failed or its answer could not be read.
+    """
+    url = params['url']
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            logger.debug(f"[Wayback Attempt {attempt}] Requesting CDX API for URL: {url} | Params={params}")
+            bucket.acquire()
+            with slots, SESSION.get(CDX_API_URL, params=params, timeout=timeout, stream=True) as response:
+                if response.status_code == 429 and attempt < MAX_RETRIES:
+                    # Retried once the bucket lets this request through again
+                    penalize_429(bucket, response, url)
+                    continue
+                response.raise_for_status()
+                return consume(response)
+
+        except requests.RequestException as e:
+            logger.warning(f"RequestException on attempt {attempt} for URL {url}: {e}")
+            if attempt == MAX_RETRIES:
+                logger.error(f"Max retries exceeded for URL {url}")
+                return None
+            sleep_time = BACKOFF_FACTOR ** (attempt - 1)
+            logger.info(f"Retrying in {sleep_time} seconds...")
+            time.sleep(sleep_time)
+        except Exception as e:
+            # JSON decode error / invalid data, among others
+            logger.error(f"Unexpected error for URL {url}: {e}")
+            return None
+
+def cdx_query(params):
+    """
+    Queries the CDX API (JSON output) through fetch_cdx(). Returns the result rows
+    without the header row; empty if there are none or the request ultimately failed.
+    """
+    data = fetch_cdx(dict(params, output="json"), lambda response: json_loads(response.content))
+    # data[0] is the header row (the 'fl' field names), data[1:] the actual rows
+    return data[1:] if data else []
+
+def timestamp_span(rows):
+    """
+    (oldest, newest) "YYYYmmddHHMMSS" timestamp in the first column of `rows`, or
+    (None, None) if there are none. One pass, no intermediate list: the strings
+    compare chronologically, so nothing is parsed or sorted.
+    """
+    rows = iter(rows)
+    row = next(rows, None)
+    if row is None:
+        return None, None
+    first_ts = last_ts = row[0]
+    for row in rows:
+        ts_str = row[0]
+        if ts_str < first_ts:
+            first_ts = ts_str
+        elif ts_str > last_ts:
+            last_ts = ts_str
+    return first_ts, last_ts
+
+def wayback_result(first_ts, last_ts, last_orig=None):
+    """
+    Turns raw CDX timestamps into (first_seen_dt, last_seen_dt, last_snapshot_link), all
+    None if there are no snapshots. The link (the clickable Wayback link for the last
+    snapshot) needs the last snapshot's original URL, and is None without it.
+    """
+    if not first_ts:
+        return None, None, None
+    last_snapshot_link = f"https://web.archive.org/web/{last_ts}/{last_orig}" if last_orig else None
+    return parse_ts(first_ts), parse_ts(last_ts), last_snapshot_link
+
+def cdx_key(url):
+    """
+    Approximation of the SURT 'urlkey' the CDX server indexes the URL's snapshots under,
+    e.g. 'http://www.a.it/x/?b=2&a=1' -> 'it,a)/x?a=1&b=2': lowercase, no scheme, 'www.'
+    or default port, host labels reversed, no trailing slash, query arguments sorted.
+    Returns None for a URL that cannot be parsed.
+    """
+    try:
+        parts = urlsplit(url.lower())
+        port = parts.port
+    except ValueError:
+        return None
+    if not parts.hostname:
+        return None
+    key = ",".join(reversed(parts.hostname.removeprefix("www.").split(".")))
+    if port and port not in (80, 443):
+        key += f":{port}"
+    key += ")" + (parts.path.rstrip("/") or "/")
+    if parts.query:
+        key += "?" + "&".join(sorted(parts.query.split("&")))
+    return key
+
+def urls_by_cdx_key(urls):
+    """
+    Groups URLs by cdx_key(), to match them against the 'urlkey' of a host dump.
+    """
+    by_key = defaultdict(list)
+    for url in urls:
+        by_key[cdx_key(url)].append(url)
+    return by_key
+
+def hosts_to_prefetch(urls, cache):
+    """
+    Groups the URLs (already validated and normalized) not yet in `cache` by host,
+    keeping only hosts with several URLs (a single URL is cheaper to query on its own).
+    Hosts are keyed without 'www.', like the SURT urlkey, so one matchType=host query
+    covers both forms but none of the host's subdomains.
+    URLs that cannot be parsed are left to their own queries.
+    """
+    by_host = defaultdict(set)
+    for url in urls:
+        if cdx_key(url) is None or cache.get(url) is not None:
+            continue
+        by_host[urlsplit(url).hostname.removeprefix("www.")].add(url)
+    return {host: urls for host, urls in by_host.items() if len(urls) > 1}